@@ -0,0 +1,162 @@
+"""
+╔════════════════════════════════════════════════════════════════════╗
+║                                                                    ║
+║     CONVERSIÓN DE MODELO - KERAS A TFLITE                         ║
+║     Script offline para acelerar la inferencia en CPU             ║
+║                                                                    ║
+╚════════════════════════════════════════════════════════════════════╝
+
+DESCRIPCIÓN:
+Convierte un modelo Keras (.h5 / .keras) a TFLite. La API carga
+automáticamente los archivos generados en lugar del modelo Keras.
+
+MODOS:
+1. FP32 - Se guarda junto al original con extensión .tflite
+2. INT8 - Cuantización entera completa calibrada con radiografías
+          reales; se guarda junto al original como <nombre>_int8.tflite
+
+USO:
+python convert_model.py models/vgg16_finetuned.h5
+python convert_model.py models/vgg16_finetuned.h5 --int8 --calib-dir test_images/
+
+REQUISITOS:
+- tensorflow y opencv (mismos que la API)
+- Para INT8: ~100 radiografías de calibración (.jpeg, .jpg, .png)
+"""
+
+# ════════════════════════════════════════════════════════════════════
+# IMPORTACIONES
+# ════════════════════════════════════════════════════════════════════
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+# ════════════════════════════════════════════════════════════════════
+# CONFIGURACIÓN
+# ════════════════════════════════════════════════════════════════════
+
+IMG_SIZE = (224, 224)
+CALIB_SAMPLES = 100
+
+# ════════════════════════════════════════════════════════════════════
+# CONVERSIÓN
+# ════════════════════════════════════════════════════════════════════
+
+def make_converter(model: keras.Model, export_dir: str) -> tf.lite.TFLiteConverter:
+    """
+    Crea el conversor a partir de un SavedModel exportado del modelo
+
+    Nota: `from_keras_model` falla con Keras 3 (TF 2.16), por eso se
+    exporta primero a SavedModel, que además conserva el lote dinámico.
+    """
+    model.export(export_dir)
+    return tf.lite.TFLiteConverter.from_saved_model(export_dir)
+
+def convert_fp32(model_path: Path) -> Path:
+    """
+    Convierte el modelo a TFLite FP32
+
+    Args:
+        model_path: Ruta al modelo Keras
+
+    Returns:
+        Path: Ruta del archivo .tflite generado
+    """
+    model = keras.models.load_model(model_path)
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        converter = make_converter(model, export_dir)
+        tflite_model = converter.convert()
+
+    output_path = model_path.with_suffix('.tflite')
+    output_path.write_bytes(tflite_model)
+
+    return output_path
+
+def representative_dataset(calib_dir: Path, num_samples: int):
+    """
+    Genera radiografías preprocesadas igual que la API para calibrar
+
+    Args:
+        calib_dir: Carpeta con imágenes de calibración
+        num_samples: Número máximo de imágenes a usar
+    """
+    paths = sorted(
+        p for p in calib_dir.iterdir()
+        if p.suffix.lower() in ('.jpeg', '.jpg', '.png')
+    )[:num_samples]
+
+    if not paths:
+        raise ValueError(f"No hay imágenes de calibración en {calib_dir}")
+
+    def generator():
+        for path in paths:
+            img = cv2.imread(str(path), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            img = cv2.resize(img, IMG_SIZE, interpolation=cv2.INTER_LINEAR)
+            img = img.astype(np.float32) / np.float32(255.0)
+            yield [np.expand_dims(img, axis=0)]
+
+    return generator
+
+def convert_int8(model_path: Path, calib_dir: Path, num_samples: int = CALIB_SAMPLES) -> Path:
+    """
+    Convierte el modelo a TFLite INT8 (cuantización entera completa)
+
+    La entrada del modelo resultante es uint8 sin normalizar: la escala
+    de cuantización de la entrada (1/255) absorbe la normalización.
+
+    Args:
+        model_path: Ruta al modelo Keras
+        calib_dir: Carpeta con imágenes de calibración
+        num_samples: Número de imágenes de calibración
+
+    Returns:
+        Path: Ruta del archivo .tflite generado
+    """
+    model = keras.models.load_model(model_path)
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        converter = make_converter(model, export_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calib_dir, num_samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        tflite_model = converter.convert()
+
+    output_path = model_path.with_name(f"{model_path.stem}_int8.tflite")
+    output_path.write_bytes(tflite_model)
+
+    return output_path
+
+# ════════════════════════════════════════════════════════════════════
+# PUNTO DE ENTRADA
+# ════════════════════════════════════════════════════════════════════
+
+def main():
+    """Parsea argumentos y convierte el modelo"""
+    parser = argparse.ArgumentParser(description="Convierte un modelo Keras a TFLite")
+    parser.add_argument("model", type=Path, help="Ruta al modelo Keras (.h5 / .keras)")
+    parser.add_argument("--int8", action="store_true", help="Cuantizar a INT8")
+    parser.add_argument("--calib-dir", type=Path, help="Carpeta con imágenes de calibración (INT8)")
+    parser.add_argument("--calib-samples", type=int, default=CALIB_SAMPLES,
+                        help=f"Imágenes de calibración a usar (por defecto {CALIB_SAMPLES})")
+    args = parser.parse_args()
+
+    if args.int8:
+        if args.calib_dir is None:
+            parser.error("--int8 requiere --calib-dir")
+        output_path = convert_int8(args.model, args.calib_dir, args.calib_samples)
+    else:
+        output_path = convert_fp32(args.model)
+    size_mb = output_path.stat().st_size / (1024 * 1024)
+    print(f"✅ Modelo guardado: {output_path} ({size_mb:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
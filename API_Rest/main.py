@@ -11,17 +11,31 @@
 # SECCIÓN 1: IMPORTACIONES
 # ════════════════════════════════════════════════════════════════════
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import APIRouter, FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram,
+    generate_latest, multiprocess
+)
 import tensorflow as tf
 from tensorflow import keras
 import numpy as np
+import cv2
 from PIL import Image
+from turbojpeg import TurboJPEG, TJPF_RGB
 import io
-import base64
-from datetime import datetime
+import pybase64
+import xxhash
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import logging
+import os
+import threading
+import time
+import warnings
 from pathlib import Path
 
 # Configurar logging
@@ -32,12 +46,31 @@ logger = logging.getLogger(__name__)
 # SECCIÓN 2: INICIALIZACIÓN DE FASTAPI
 # ════════════════════════════════════════════════════════════════════
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca y detiene el agrupador de peticiones junto con la API"""
+    # Pool de hilos para decodificación, preprocesado e inferencia, con la
+    # parte de CPU de este worker (+1 para que la decodificación siga
+    # avanzando mientras el batcher ocupa un hilo con el modelo)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADS_PER_WORKER + 1)
+    )
+    
+    # Precalentar el modelo: la API solo queda lista al terminar
+    await asyncio.to_thread(warmup_model)
+    
+    dyn_batcher.start()
+    yield
+    await dyn_batcher.stop()
+
 app = FastAPI(
     title="API de Detección de Neumonía",
     description="API REST para clasificar radiografías de tórax como NORMAL o PNEUMONIA",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # Serialización JSON con orjson
 )
 
 # Configurar CORS
@@ -55,6 +88,100 @@ app.add_middleware(
 
 MODEL_DIR = Path(__file__).parent / ("models")
 IMG_SIZE = (224, 224)
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10 MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64 KB
+
+# Procesos de uvicorn (misma variable que usa `uvicorn --workers`) e
+# hilos de inferencia y de OpenCV por proceso, para no sobresuscribir la CPU
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // WORKERS)
+
+tf.config.threading.set_intra_op_parallelism_threads(THREADS_PER_WORKER)
+tf.config.threading.set_inter_op_parallelism_threads(2)
+cv2.setNumThreads(THREADS_PER_WORKER)
+
+class KerasModel:
+    """
+    Modelo Keras servido con una `tf.function` de firma fija
+    
+    Se traza una sola vez (lote dinámico) y evita la maquinaria por
+    llamada de `model.predict` (adaptadores de datos, callbacks, etc.).
+    """
+    
+    def __init__(self, keras_model: keras.Model):
+        self.keras_model = keras_model
+        self._infer = tf.function(
+            lambda x: keras_model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + IMG_SIZE + (3,), tf.float32)]
+        )
+    
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Predice un lote (N, 224, 224, 3) y devuelve (N, 1)"""
+        return self._infer(batch).numpy()
+
+class TFLiteModel:
+    """
+    Modelo TFLite con la misma interfaz de predicción que KerasModel
+    
+    Usa los kernels optimizados de TFLite (XNNPACK) y evita el coste por
+    llamada de `model.predict` en Keras. Los modelos INT8 reciben la
+    imagen uint8 sin normalizar (ver `input_dtype`).
+    
+    El intérprete mapea el archivo en memoria (mmap), pero XNNPACK
+    reempaqueta los pesos de convoluciones y capas densas en memoria
+    propia de cada proceso: cada worker ocupa su copia de los pesos.
+    """
+    
+    def __init__(self, path: Path):
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(path),
+            num_threads=THREADS_PER_WORKER
+        )
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self._input_index = input_details['index']
+        self._output_index = output_details['index']
+        self._output_quant = output_details['quantization']
+        self._batch_size = None
+        
+        # float32 para modelos FP32, uint8 para modelos cuantizados
+        self.input_dtype = input_details['dtype']
+        
+        # La imagen uint8 se pasa tal cual si la escala de entrada es 1/255;
+        # si la calibración dio otra escala, se recuantiza con una tabla
+        self._input_lut = None
+        scale, zero_point = input_details['quantization']
+        if self.input_dtype == np.uint8 and (zero_point != 0 or not np.isclose(scale * 255.0, 1.0, rtol=1e-3)):
+            levels = np.arange(256, dtype=np.float32) / 255.0
+            self._input_lut = np.clip(np.round(levels / scale + zero_point), 0, 255).astype(np.uint8)
+    
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Predice un lote (N, 224, 224, 3) y devuelve (N, 1)"""
+        # Reservar tensores solo cuando cambia el tamaño del lote
+        if len(batch) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        
+        if self._input_lut is not None:
+            batch = np.take(self._input_lut, batch)
+        
+        self.interpreter.set_tensor(self._input_index, batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self._output_index)
+        
+        # Descuantizar si la salida también es entera
+        if output.dtype != np.float32:
+            scale, zero_point = self._output_quant
+            output = (output.astype(np.float32) - zero_point) * scale
+        
+        return output
+
+def load_model_file(path: Path):
+    """Carga un modelo .tflite o Keras (solo inferencia) según la extensión"""
+    if path.suffix == '.tflite':
+        return TFLiteModel(path)
+    return KerasModel(keras.models.load_model(path, compile=False))
 
 # Intentar cargar modelo en orden de preferencia
 model = None
@@ -66,57 +193,444 @@ model_priority = [
     ('baseline_best.h5', 'CNN Baseline')
 ]
 
+# Si existen versiones convertidas junto al .h5 (ver convert_model.py), se
+# prefieren: primero la INT8 (<nombre>_int8.tflite) y luego la .tflite FP32
+# Cada candidato lleva el modelo Keras del que procede (None si es el propio)
+model_candidates = []
 for filename, name in model_priority:
     model_path = MODEL_DIR / filename
-    if model_path.exists():
-        try:
-            model = keras.models.load_model(model_path)
-            model_name = name
-            logger.info(f"✅ Modelo cargado: {name}")
-            break
-        except Exception as e:
-            logger.error(f"❌ Error cargando {name}: {e}")
-            continue
+    model_candidates.append((model_path.with_name(f"{model_path.stem}_int8.tflite"), f"{name} (INT8)", model_path))
+    model_candidates.append((model_path.with_suffix('.tflite'), f"{name} (TFLite)", model_path))
+    model_candidates.append((model_path, name, None))
+
+def is_stale(converted: Path, source: Path) -> bool:
+    """Indica si una versión convertida es anterior a su modelo Keras (reentrenado después)"""
+    return source.exists() and converted.stat().st_mtime < source.stat().st_mtime
+
+# Con `python main.py` y varios workers este proceso solo lanza uvicorn (ver
+# el punto de entrada), que importa el módulo como `main` en cada worker
+IS_SUPERVISOR = __name__ == "__main__" and WORKERS > 1
+
+if not IS_SUPERVISOR:
+    for model_path, name, source_path in model_candidates:
+        if model_path.exists():
+            if source_path is not None and is_stale(model_path, source_path):
+                logger.warning(
+                    f"⚠️ {model_path.name} es anterior a {source_path.name}, se ignora "
+                    f"(volver a ejecutar convert_model.py)"
+                )
+                continue
+            try:
+                model = load_model_file(model_path)
+                model_name = name
+                logger.info(f"✅ Modelo cargado: {name}")
+                break
+            except Exception as e:
+                logger.error(f"❌ Error cargando {name}: {e}")
+                continue
+    
+    if model is None:
+        logger.error("❌ No se pudo cargar ningún modelo")
+    else:
+        logger.info(f"✅ API lista con modelo: {model_name}")
 
-if model is None:
-    logger.error("❌ No se pudo cargar ningún modelo")
-else:
-    logger.info(f"✅ API lista con modelo: {model_name}")
+# Tipo de entrada que espera el modelo (uint8 en modelos INT8)
+model_input_dtype = getattr(model, 'input_dtype', np.float32)
 
 # ════════════════════════════════════════════════════════════════════
 # SECCIÓN 4: FUNCIONES AUXILIARES
 # ════════════════════════════════════════════════════════════════════
 
-def preprocess_image(image: Image.Image) -> np.ndarray:
+# Métricas de latencia por etapa (expuestas en /metrics)
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+DECODE_SECONDS = Histogram('decode_seconds', 'Tiempo de decodificación de la imagen', buckets=LATENCY_BUCKETS)
+PREPROCESS_SECONDS = Histogram('preprocess_seconds', 'Tiempo de preprocesado de la imagen', buckets=LATENCY_BUCKETS)
+INFERENCE_SECONDS = Histogram('inference_seconds', 'Tiempo de inferencia del modelo por lote', buckets=LATENCY_BUCKETS)
+POSTPROCESS_SECONDS = Histogram('postprocess_seconds', 'Tiempo de construcción de respuestas por lote', buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram('batch_size', 'Imágenes por llamada al modelo', buckets=(1, 2, 3, 4, 5, 6, 7, 8))
+
+# Tabla uint8 -> float32 con los 256 valores ya normalizados (x / 255.0)
+_NORM_LUT = np.arange(256, dtype=np.float32) / np.float32(255.0)
+
+# libjpeg-turbo para JPEG (SIMD); requiere la librería del sistema
+try:
+    _turbo_jpeg = TurboJPEG()
+except Exception as e:
+    _turbo_jpeg = None
+    logger.warning(f"⚠️ TurboJPEG no disponible, se usará OpenCV: {e}")
+
+# Reducciones DCT de JPEG soportadas también por OpenCV (IMREAD_REDUCED_*):
+# con o sin libjpeg-turbo instalada, el modelo recibe la misma imagen
+_JPEG_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+def jpeg_reduction(width: int, height: int) -> int:
+    """Mayor divisor (8, 4, 2 o 1) que mantiene la imagen >= 224x224"""
+    for den in (8, 4, 2):
+        if width >= IMG_SIZE[0] * den and height >= IMG_SIZE[1] * den:
+            return den
+    return 1
+
+# Por encima de Image.MAX_IMAGE_PIXELS, PIL solo avisa hasta el doble:
+# convertir el aviso en excepción para rechazar siempre en ese límite
+warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+def image_size(contents: bytes) -> tuple:
     """
-    Preprocesa imagen para el modelo
+    Lee el tamaño de la imagen de su cabecera, sin decodificar píxeles
+    
+    OpenCV no limita el tamaño decodificado (hasta 2^30 píxeles) y el
+    límite de 10 MB solo cubre los bytes comprimidos: una imagen pequeña
+    puede ocupar varios GB al decodificarse. Se rechaza antes de hacerlo.
+    
+    Args:
+        contents: Bytes de la imagen
+        
+    Returns:
+        tuple: Tamaño como (ancho, alto)
+    """
+    try:
+        width, height = Image.open(io.BytesIO(contents)).size
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        width = height = None
+    except Exception:
+        raise HTTPException(
+            status_code=400,
+            detail="Archivo no es una imagen válida"
+        )
+    
+    if width is None or width * height > Image.MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagen muy grande. Máximo: {Image.MAX_IMAGE_PIXELS} píxeles"
+        )
+    
+    return width, height
+
+def decode_image(contents: bytes) -> tuple:
+    """
+    Decodifica los bytes de la imagen
+    
+    Los JPEG se reducen durante la propia decodificación (1/2, 1/4 u 1/8)
+    con libjpeg-turbo o, si no está instalada, con el mismo factor en
+    OpenCV. Ninguna ruta aplica la orientación EXIF. El resto de formatos
+    se decodifican con OpenCV a tamaño completo.
     
     Args:
-        image: Imagen PIL
+        contents: Bytes de la imagen
         
     Returns:
-        np.ndarray: Array normalizado (1, 224, 224, 3)
+        tuple: (imagen RGB uint8 (alto, ancho, 3), tamaño original como (ancho, alto))
     """
-    # Convertir a RGB si es necesario
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    # Rechaza bombas de descompresión antes de reservar memoria (4xx,
+    # fuera de cualquier respaldo)
+    size = image_size(contents)
+    flags = cv2.IMREAD_COLOR
     
-    # Redimensionar
-    image = image.resize(IMG_SIZE)
+    if contents[:2] == b'\xff\xd8':
+        # La misma reducción para libjpeg-turbo y para el respaldo de OpenCV
+        reduction = jpeg_reduction(*size)
+        flags = _JPEG_REDUCED_FLAGS[reduction]
+        
+        if _turbo_jpeg is not None:
+            try:
+                img = _turbo_jpeg.decode(
+                    contents,
+                    pixel_format=TJPF_RGB,
+                    scaling_factor=(1, reduction)
+                )
+                return img, size
+            except Exception as e:
+                logger.warning(f"⚠️ TurboJPEG falló, se usará OpenCV: {e}")
     
-    # Convertir a array y normalizar
-    img_array = np.array(image)
-    img_array = img_array.astype('float32') / 255.0
+    img = cv2.imdecode(
+        np.frombuffer(contents, np.uint8),
+        flags | cv2.IMREAD_IGNORE_ORIENTATION
+    )
     
-    # Agregar dimensión de batch
-    img_array = np.expand_dims(img_array, axis=0)
+    # Respaldo con PIL para formatos que OpenCV no soporta (GIF, etc.)
+    if img is None:
+        image = Image.open(io.BytesIO(contents))
+        return np.asarray(image.convert('RGB')), image.size
+    
+    # OpenCV decodifica en BGR; se convierte sobre el mismo array
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img), size
+
+# Buffers reutilizables por hilo del pool (sin reservar memoria por petición)
+_thread_buffers = threading.local()
+
+def _resize_buffer() -> np.ndarray:
+    """Buffer uint8 (224, 224, 3) del hilo actual para cv2.resize"""
+    buffer = getattr(_thread_buffers, 'resized', None)
+    if buffer is None:
+        buffer = _thread_buffers.resized = np.empty(IMG_SIZE + (3,), dtype=np.uint8)
+    return buffer
+
+def preprocess_image(img: np.ndarray) -> np.ndarray:
+    """
+    Preprocesa imagen para el modelo
+    
+    Args:
+        img: Imagen RGB uint8 (alto, ancho, 3)
+        
+    Returns:
+        np.ndarray: Array normalizado (1, 224, 224, 3); uint8 sin
+            normalizar si el modelo está cuantizado
+    """
+    # Modelo INT8: la escala de cuantización ya incluye el / 255
+    if model_input_dtype == np.uint8:
+        img = cv2.resize(img, IMG_SIZE, interpolation=cv2.INTER_LINEAR)
+        return np.expand_dims(img, axis=0)
+    
+    # Redimensionar sobre el buffer del hilo (se consume aquí mismo)
+    resized = cv2.resize(img, IMG_SIZE, dst=_resize_buffer(), interpolation=cv2.INTER_LINEAR)
+    
+    # Convertir a float32 y normalizar en una sola pasada con la tabla,
+    # escribiendo directamente en el array con dimensión de batch
+    img_array = np.empty((1,) + IMG_SIZE + (3,), dtype=np.float32)
+    cv2.LUT(resized, _NORM_LUT, dst=img_array[0])
     
     return img_array
 
-def make_prediction(img_array: np.ndarray) -> dict:
+def load_image(contents: bytes) -> tuple:
+    """
+    Decodifica y preprocesa la imagen (trabajo bloqueante, se ejecuta en un hilo)
+    
+    Args:
+        contents: Bytes de la imagen
+        
+    Returns:
+        tuple: (array preprocesado, tamaño original como (ancho, alto))
+    """
+    with DECODE_SECONDS.time():
+        img, size = decode_image(contents)
+    
+    with PREPROCESS_SECONDS.time():
+        img_array = preprocess_image(img)
+    
+    return img_array, size
+
+def epoch_ms() -> int:
+    """Marca de tiempo en milisegundos desde epoch (el cliente la formatea)"""
+    return time.time_ns() // 1_000_000
+
+def predict_batch(images: list) -> list:
+    """
+    Realiza predicción sobre un lote de imágenes con el modelo cargado
+    
+    Args:
+        images: Lista de imágenes preprocesadas (1, 224, 224, 3)
+        
+    Returns:
+        list: Un resultado por imagen, en el mismo orden
+    """
+    # Una sola llamada al modelo para todo el lote; el lote se copia en un
+    # buffer fijo (el batcher procesa un lote cada vez, así que es seguro)
+    batch = np.concatenate(images, axis=0, out=_batch_buffer[:len(images)])
+    BATCH_SIZE.observe(len(images))
+    
+    with INFERENCE_SECONDS.time():
+        predictions = model.predict(batch)
+    
+    with POSTPROCESS_SECONDS.time():
+        # Una marca de tiempo por lote
+        timestamp_ms = epoch_ms()
+        
+        results = []
+        # tolist() convierte todo el lote a float de Python de una vez
+        for p in predictions[:, 0].tolist():
+            # Determinar clase
+            is_pneumonia = p > 0.5
+            p_normal = 1.0 - p
+            
+            # Construir respuesta
+            results.append({
+                "prediction": "PNEUMONIA" if is_pneumonia else "NORMAL",
+                "confidence": p if is_pneumonia else p_normal,
+                "probabilities": {
+                    "NORMAL": p_normal,
+                    "PNEUMONIA": p
+                },
+                "model_used": model_name,
+                "timestamp_ms": timestamp_ms
+            })
+    
+    return results
+
+class DynamicBatcher:
+    """
+    Agrupa peticiones concurrentes en lotes para el modelo
+    
+    Cada petición deja su imagen en una cola compartida; una corrutina
+    de fondo toma hasta `max_batch_size` imágenes ya encoladas, llama al
+    modelo una sola vez y devuelve a cada petición su resultado.
+    
+    No hay espera artificial: con el modelo libre, una petición sola sale
+    al instante; mientras un lote está en inferencia, las peticiones que
+    llegan se acumulan en la cola y forman el siguiente lote.
+    """
+    
+    def __init__(self, infer, max_batch_size: int = 8):
+        self.infer = infer
+        self.max_batch_size = max_batch_size
+        self._queue = None
+        self._task = None
+    
+    def start(self):
+        """Crea la cola y lanza la corrutina de fondo"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Detiene la corrutina de fondo"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def process_batched(self, img_array: np.ndarray) -> dict:
+        """Encola una imagen y espera el resultado de su lote"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((img_array, future))
+        return await future
+    
+    async def _collect(self) -> list:
+        """Espera la primera imagen y añade las que ya estén en la cola"""
+        items = [await self._queue.get()]
+        
+        while len(items) < self.max_batch_size and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        
+        return items
+    
+    async def _run(self):
+        """Bucle principal: junta un lote, predice y reparte resultados"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            # Descartar peticiones canceladas mientras esperaban
+            items = [(img, fut) for img, fut in items if not fut.cancelled()]
+            if not items:
+                continue
+            
+            try:
+                # El modelo corre en un hilo para no bloquear el event loop
+                results = await loop.run_in_executor(
+                    None, self.infer, [img for img, _ in items]
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+dyn_batcher = DynamicBatcher(predict_batch, max_batch_size=8)
+
+# Buffer de entrada del modelo para el lote máximo
+_batch_buffer = np.empty(
+    (dyn_batcher.max_batch_size,) + IMG_SIZE + (3,),
+    dtype=model_input_dtype
+)
+
+def warmup_model(iterations: int = 3):
+    """
+    Ejecuta el modelo con imágenes vacías antes de la primera petición
+    
+    La primera llamada compila kernels y traza el grafo, lo que dispara
+    la latencia de la primera petición real.
+    
+    Args:
+        iterations: Número de pasadas con lote de 1 imagen
+    """
+    if model is None:
+        return
+    
+    start = time.perf_counter()
+    shape = IMG_SIZE + (3,)
+    
+    for _ in range(iterations):
+        model.predict(np.zeros((1,) + shape, dtype=model_input_dtype))
+    
+    # También el lote máximo, para no retrazar con el primer pico de tráfico
+    model.predict(np.zeros((dyn_batcher.max_batch_size,) + shape, dtype=model_input_dtype))
+    
+    logger.info(f"🔥 Modelo precalentado en {time.perf_counter() - start:.2f} s")
+
+async def read_upload(file: UploadFile, limit: int) -> bytearray:
+    """
+    Lee el archivo subido por bloques, abortando en cuanto supera el límite
+    
+    Args:
+        file: Archivo subido
+        limit: Tamaño máximo en bytes
+        
+    Returns:
+        bytearray: Contenido del archivo
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail="Imagen muy grande. Máximo: 10 MB"
+    )
+    
+    # Rechazo inmediato si el tamaño ya se conoce
+    if file.size is not None and file.size > limit:
+        raise too_large
+    
+    contents = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        contents.extend(chunk)
+        if len(contents) > limit:
+            raise too_large
+    
+    return contents
+
+# Caché LRU de resultados por hash del contenido de la imagen; solo se
+# accede desde el event loop, así que no necesita lock
+PREDICTION_CACHE_SIZE = 256
+_prediction_cache = OrderedDict()
+
+def get_cached_prediction(key: int):
+    """
+    Busca un resultado previo para la misma imagen
+    
+    Args:
+        key: Hash xxh3 de los bytes de la imagen
+        
+    Returns:
+        dict | None: Resultado con marca de tiempo actual, o None si no está
+    """
+    cached = _prediction_cache.get(key)
+    if cached is None:
+        return None
+    
+    _prediction_cache.move_to_end(key)
+    return {**cached, "timestamp_ms": epoch_ms()}
+
+def cache_prediction(key: int, result: dict):
+    """Guarda un resultado (sin marca de tiempo) descartando el más antiguo"""
+    _prediction_cache[key] = {k: v for k, v in result.items() if k != "timestamp_ms"}
+    _prediction_cache.move_to_end(key)
+    if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+        _prediction_cache.popitem(last=False)
+
+async def make_prediction(img_array: np.ndarray) -> dict:
     """
     Realiza predicción usando el modelo cargado
     
+    La imagen se encola en el batcher y se procesa junto con las demás
+    peticiones concurrentes.
+    
     Args:
         img_array: Imagen preprocesada
         
@@ -129,31 +643,31 @@ def make_prediction(img_array: np.ndarray) -> dict:
             detail="Modelo no disponible. Verifica carpeta 'models/'"
         )
     
-    # Hacer predicción
-    prediction = model.predict(img_array, verbose=0)[0][0]
-    
-    # Determinar clase
-    predicted_class = "PNEUMONIA" if prediction > 0.5 else "NORMAL"
-    confidence = float(prediction if prediction > 0.5 else 1 - prediction)
-    
-    # Construir respuesta
-    result = {
-        "prediction": predicted_class,
-        "confidence": confidence,
-        "probabilities": {
-            "NORMAL": float(1 - prediction),
-            "PNEUMONIA": float(prediction)
-        },
-        "model_used": model_name,
-        "timestamp": datetime.now().isoformat()
-    }
-    
-    return result
+    return await dyn_batcher.process_batched(img_array)
 
 # ════════════════════════════════════════════════════════════════════
 # SECCIÓN 5: ENDPOINTS
 # ════════════════════════════════════════════════════════════════════
 
+# /health va en su propio router, registrado antes que el resto: nunca pasa
+# por el batcher ni el modelo, así que responde al instante aunque la
+# inferencia esté saturada. El estado no cambia tras el arranque.
+health_router = APIRouter()
+
+_health_status = {
+    "status": "healthy" if model is not None else "degraded",
+    "model_loaded": model is not None,
+    "model_name": model_name if model else "None",
+    "message": "API funcionando correctamente" if model else "API sin modelo cargado"
+}
+
+@health_router.get("/health")
+async def health_check():
+    """Endpoint de health check - Verifica estado"""
+    return ORJSONResponse({**_health_status, "timestamp_ms": epoch_ms()})
+
+app.include_router(health_router)
+
 @app.get("/")
 async def root():
     """Endpoint raíz - Información general"""
@@ -167,6 +681,7 @@ async def root():
             "/health": "Estado del sistema",
             "/predict": "POST - Predicción con archivo",
             "/predict_base64": "POST - Predicción con base64",
+            "/metrics": "Métricas Prometheus",
             "/docs": "Documentación Swagger",
             "/redoc": "Documentación ReDoc"
         },
@@ -176,16 +691,24 @@ async def root():
         }
     }
 
-@app.get("/health")
-async def health_check():
-    """Endpoint de health check - Verifica estado"""
-    return {
-        "status": "healthy" if model is not None else "degraded",
-        "model_loaded": model is not None,
-        "model_name": model_name if model else "None",
-        "timestamp": datetime.now().isoformat(),
-        "message": "API funcionando correctamente" if model else "API sin modelo cargado"
-    }
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato Prometheus (latencias por etapa y tamaño de lote)"""
+    registry = REGISTRY
+    
+    # Con varios workers, agregar las métricas de todos los procesos
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    elif WORKERS > 1:
+        # Sin carpeta compartida cada worker solo vería sus propias métricas
+        raise HTTPException(
+            status_code=503,
+            detail="Con varios workers, /metrics requiere PROMETHEUS_MULTIPROC_DIR"
+        )
+    
+    # Cabecera explícita: con media_type, Starlette añade un segundo charset
+    return Response(generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
 
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
@@ -206,30 +729,28 @@ async def predict(file: UploadFile = File(...)):
                 detail=f"Archivo debe ser imagen. Recibido: {file.content_type}"
             )
         
-        # Leer archivo
-        contents = await file.read()
+        # Leer archivo validando tamaño (10 MB máx)
+        contents = await read_upload(file, MAX_IMAGE_BYTES)
         
-        # Validar tamaño (10 MB máx)
-        if len(contents) > 10 * 1024 * 1024:
-            raise HTTPException(
-                status_code=413,
-                detail="Imagen muy grande. Máximo: 10 MB"
-            )
-        
-        # Abrir imagen
-        image = Image.open(io.BytesIO(contents))
+        # Misma imagen ya procesada: responder desde la caché
+        cache_key = xxhash.xxh3_64_intdigest(contents)
+        result = get_cached_prediction(cache_key)
+        if result is not None:
+            logger.info(f"♻️ Predicción en caché: {result['prediction']} ({result['confidence']:.2%})")
+            return result
         
-        logger.info(f"📸 Imagen: {file.filename}, Tamaño: {image.size}")
+        # Abrir y preprocesar fuera del event loop
+        img_array, size = await asyncio.to_thread(load_image, contents)
         
-        # Preprocesar
-        img_array = preprocess_image(image)
+        logger.info(f"📸 Imagen: {file.filename}, Tamaño: {size}")
         
         # Predecir
-        result = make_prediction(img_array)
+        result = await make_prediction(img_array)
+        cache_prediction(cache_key, result)
         
         logger.info(f"✅ Predicción: {result['prediction']} ({result['confidence']:.2%})")
         
-        return JSONResponse(content=result)
+        return result
     
     except HTTPException:
         raise
@@ -253,35 +774,61 @@ async def predict_base64(data: dict):
     """
     try:
         # Validar campo
-        if "image" not in data:
+        if not isinstance(data.get("image"), str):
             raise HTTPException(
                 status_code=400,
                 detail='Campo "image" requerido con string base64'
             )
         
-        # Decodificar
+        image_b64 = data["image"]
+        
+        # Quitar prefijo data URL ("data:image/jpeg;base64,...")
+        if image_b64.startswith("data:"):
+            image_b64 = image_b64.partition(",")[2]
+        
+        # Validar tamaño antes de decodificar (10 MB máx)
+        if len(image_b64) * 3 // 4 > MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail="Imagen muy grande. Máximo: 10 MB"
+            )
+        
+        # Decodificar (pybase64 usa SIMD, mucho más rápido que base64);
+        # validate=True rechaza caracteres inválidos sin procesar el resto
         try:
-            image_data = base64.b64decode(data["image"])
+            image_data = pybase64.b64decode(image_b64, validate=True)
         except Exception as e:
             raise HTTPException(
                 status_code=400,
                 detail=f"Error decodificando base64: {str(e)}"
             )
         
-        # Abrir imagen
-        image = Image.open(io.BytesIO(image_data))
+        # Cadena vacía o data URL sin datos ("data:foo")
+        if not image_data:
+            raise HTTPException(
+                status_code=400,
+                detail="Imagen base64 vacía"
+            )
+        
+        # Misma imagen ya procesada: responder desde la caché
+        cache_key = xxhash.xxh3_64_intdigest(image_data)
+        result = get_cached_prediction(cache_key)
+        if result is not None:
+            logger.info(f"♻️ Predicción en caché: {result['prediction']} ({result['confidence']:.2%})")
+            return result
         
-        logger.info(f"📸 Imagen base64, Tamaño: {image.size}")
+        # Abrir y preprocesar fuera del event loop
+        img_array, size = await asyncio.to_thread(load_image, image_data)
         
-        # Preprocesar
-        img_array = preprocess_image(image)
+        logger.info(f"📸 Imagen base64, Tamaño: {size}")
         
         # Predecir
-        result = make_prediction(img_array)
+        result = await make_prediction(img_array)
+        cache_prediction(cache_key, result)
         
         logger.info(f"✅ Predicción: {result['prediction']} ({result['confidence']:.2%})")
         
-        return JSONResponse(content=result)
+        return result
     
     except HTTPException:
         raise
@@ -297,6 +844,7 @@ async def predict_base64(data: dict):
 # ════════════════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
     
     print("""
@@ -310,4 +858,17 @@ if __name__ == "__main__":
     Presiona Ctrl+C para detener
     """)
     
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Un worker salvo que se indique WEB_CONCURRENCY (cada worker carga su
+    # propio modelo)
+    if WORKERS == 1:
+        # Se sirve esta misma app, sin volver a importar el módulo
+        uvicorn.run(app, host="0.0.0.0", port=8000)
+    else:
+        # Se reemplaza este proceso por la CLI de uvicorn: los workers
+        # importan "main:app" sin repetir este script ni su modelo
+        os.execv(sys.executable, [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--app-dir", str(Path(__file__).parent),
+            "--host", "0.0.0.0", "--port", "8000",
+            "--workers", str(WORKERS)
+        ])
\ No newline at end of file
@@ -46,6 +46,12 @@ API_URL = "http://localhost:8000"  # Local
 # API_URL = "https://tu-app.onrender.com"  # Render
 # API_URL = "https://tu-usuario-pneumonia-api.hf.space"  # Hugging Face
 
+# Tamaño máximo de imagen aceptado por la API
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10 MB
+
+# PNG de 1x1 píxel, para probar entradas válidas sin imágenes de prueba
+TINY_PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+
 # Colores para terminal
 class Colors:
     HEADER = '\033[95m'
@@ -152,7 +158,7 @@ def test_predict_file(image_path):
             print_test(f"✅ Prob NORMAL: {data.get('probabilities', {}).get('NORMAL'):.2%}", "success")
             print_test(f"✅ Prob PNEUMONIA: {data.get('probabilities', {}).get('PNEUMONIA'):.2%}", "success")
             print_test(f"✅ Modelo usado: {data.get('model_used')}", "success")
-            print_test(f"✅ Timestamp: {data.get('timestamp')}", "success")
+            print_test(f"✅ Timestamp (ms): {data.get('timestamp_ms')}", "success")
             
             # Validaciones
             confidence = data.get('confidence', 0)
@@ -232,6 +238,10 @@ def test_invalid_inputs():
     VERIFICA:
     - Archivo no-imagen es rechazado
     - Base64 inválido es manejado
+    - Prefijo data URL es aceptado
+    - Base64 demasiado grande se rechaza antes de decodificar
+    - Campo "image" no-string o vacío es rechazado
+    - Archivo de más de 10 MB es rechazado
     - Errores retornan códigos apropiados
     """
     print_test("\n" + "="*70, "header")
@@ -239,7 +249,7 @@ def test_invalid_inputs():
     print_test("="*70, "header")
     
     tests_passed = 0
-    total_tests = 3
+    total_tests = 8
     
     # Test 4.1: Enviar archivo no-imagen
     print_test("\n4.1 - Enviar archivo de texto (debe fallar):", "info")
@@ -287,6 +297,84 @@ def test_invalid_inputs():
     except Exception as e:
         print_test(f"❌ Error: {e}", "error")
     
+    # Test 4.4: Prefijo data URL
+    print_test("\n4.4 - Base64 con prefijo data URL (debe funcionar):", "info")
+    try:
+        response = requests.post(
+            f"{API_URL}/predict_base64",
+            json={"image": f"data:image/png;base64,{TINY_PNG_B64}"}
+        )
+        
+        if response.status_code == 200:
+            print_test("✅ Status 200 retornado correctamente", "success")
+            tests_passed += 1
+        else:
+            print_test(f"❌ Se esperaba 200, recibido {response.status_code}", "error")
+    except Exception as e:
+        print_test(f"❌ Error: {e}", "error")
+    
+    # Test 4.5: Base64 de más de 10 MB
+    print_test("\n4.5 - Base64 mayor de 10 MB (debe fallar):", "info")
+    try:
+        response = requests.post(
+            f"{API_URL}/predict_base64",
+            json={"image": "A" * (MAX_IMAGE_BYTES * 4 // 3 + 4)}
+        )
+        
+        if response.status_code == 413:
+            print_test("✅ Error 413 retornado correctamente", "success")
+            tests_passed += 1
+        else:
+            print_test(f"❌ Se esperaba 413, recibido {response.status_code}", "error")
+    except Exception as e:
+        print_test(f"❌ Error: {e}", "error")
+    
+    # Test 4.6: Campo 'image' que no es string
+    print_test("\n4.6 - Campo 'image' no-string (debe fallar):", "info")
+    try:
+        response = requests.post(
+            f"{API_URL}/predict_base64",
+            json={"image": 123}
+        )
+        
+        if response.status_code == 400:
+            print_test("✅ Error 400 retornado correctamente", "success")
+            tests_passed += 1
+        else:
+            print_test(f"❌ Se esperaba 400, recibido {response.status_code}", "error")
+    except Exception as e:
+        print_test(f"❌ Error: {e}", "error")
+    
+    # Test 4.7: Base64 vacío o data URL sin datos
+    print_test("\n4.7 - Base64 vacío y 'data:foo' (deben fallar):", "info")
+    try:
+        status_codes = [
+            requests.post(f"{API_URL}/predict_base64", json={"image": image}).status_code
+            for image in ("", "data:foo")
+        ]
+        
+        if status_codes == [400, 400]:
+            print_test("✅ Error 400 retornado correctamente", "success")
+            tests_passed += 1
+        else:
+            print_test(f"❌ Se esperaba [400, 400], recibido {status_codes}", "error")
+    except Exception as e:
+        print_test(f"❌ Error: {e}", "error")
+    
+    # Test 4.8: Archivo de más de 10 MB
+    print_test("\n4.8 - Archivo mayor de 10 MB (debe fallar):", "info")
+    try:
+        files = {'file': ('big.jpg', b'\0' * (MAX_IMAGE_BYTES + 1), 'image/jpeg')}
+        response = requests.post(f"{API_URL}/predict", files=files)
+        
+        if response.status_code == 413:
+            print_test("✅ Error 413 retornado correctamente", "success")
+            tests_passed += 1
+        else:
+            print_test(f"❌ Se esperaba 413, recibido {response.status_code}", "error")
+    except Exception as e:
+        print_test(f"❌ Error: {e}", "error")
+    
     print_test(f"\n✅ Tests de error pasados: {tests_passed}/{total_tests}", "success")
     return tests_passed == total_tests
 